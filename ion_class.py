@@ -6,13 +6,11 @@
 
 
 import numpy as np
+import numba as nb
 import scipy as sc
 import matplotlib.pyplot as plt
 from matplotlib.ticker import (MultipleLocator, AutoMinorLocator, LogFormatter)
 
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Rectangle
-from matplotlib.cm import ScalarMappable
 from matplotlib.colors import ListedColormap
 
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
@@ -21,6 +19,28 @@ import os.path
 import copy
 from typing import BinaryIO
 
+
+@nb.njit(parallel=True, fastmath=True, cache=True)
+def _ca_scan(aver_amp, echoes_tmp, row_3s, out):
+    """
+    Проход клеточного автомата по столбцам (частотам) матрицы
+    Столбцы независимы и обрабатываются параллельно, найденные точки записываются в out
+    """
+    for i in nb.prange(aver_amp.shape[1]):
+        cmax_amp = 0.0
+        incr_flag = True
+        for j in range(aver_amp.shape[0]):
+            if(aver_amp[j, i] > row_3s[i]):
+                if(cmax_amp <= aver_amp[j, i]):
+                    incr_flag = True
+                    cmax_amp = aver_amp[j, i]
+                else:
+                    if(incr_flag and echoes_tmp[j, i] != 0):
+                        out[j, i] = int(echoes_tmp[j, i])
+                        incr_flag = False
+            else:
+                cmax_amp = 0.0
+
 class Ionogram():
     """
     Класс ионограмм
@@ -35,7 +55,7 @@ class Ionogram():
     get_dimension - выдать разрешение по шкале высот
     get_ionogram - выдача матрицы ионограммы
     plot_ionogram - построение ионограммы
-    plot_ionogram_rect - построение ионограммы патчами
+    plot_ionogram_rect - построение ионограммы ячейками сетки
     plot_noise - построение частотной зависимости "шума"
 
     Вторичная обработка
@@ -45,22 +65,26 @@ class Ionogram():
     Экспериментальные функции (пользоваться осторожно!)
     __eq__ и __ne__- "сравнение" ионограмм: операции "==" и "!="
     __add__ и __iadd__- "сложение" ионограмм: операции "+" и "+="
-    __truediv__ - деление ионограммы на скалярное число "/scalar"
+    __truediv__ и __itruediv__ - деление ионограммы на скалярное число: операции "/scalar" и "/=scalar"
     """
     light_velocity = 3.0e+8
     nheights = 512
     nfrequences = 512   
     __delimeter = '\x00\x00\x00\x00'
-    __cluster_flag = b'\x80'
+    __cluster_flag = 0x8000
     __align = 1
+    __formats = {'s': ' {:s}', 'f': ' {:.4f}', 'd': ' {:d}'}
 
     
     def __init__(self):
-        self.noise = []
-        self.echoes = []
-        self.ionogram_matrix = []
-        self.medfilt2d = []
-        self.cellular_automaton = []
+        self.noise_fn = np.empty(0, dtype=np.int32)
+        self.noise_amp = np.empty(0, dtype=np.float64)
+        self.echo_fn = np.empty(0, dtype=np.int32)
+        self.echo_it = np.empty(0, dtype=np.int32)
+        self.echo_amp = np.empty(0, dtype=np.float64)
+        self.ionogram_matrix = None
+        self.medfilt2d = None
+        self.cellular_automaton = None
         self.first_delay = 0
         self.nheights = 512
         self.maxheight = 0
@@ -84,17 +108,36 @@ class Ionogram():
             'longitude':  {'value': 0, 'type': 'f', 'description': 'Долгота пункта приёма',                'units': ''}, 
             'height':     {'value': 0, 'type': 'f', 'description': 'Высота пункта приёма',                 'units': ''},
         }
+        for par in self.__parameters:
+            self.__parameters[par]['fmt'] = Ionogram.__formats[self.__parameters[par]['type']]
+        self.__passport_cache = None
+        self.__frequences = None
+        self.__heights = None
         self.__ionogram_loaded = False
         
     def __str__(self):
         info = ''
         if(self.__ionogram_loaded):
-            info = "Current:\n {:s}\n{:s} UT".format(self.__parameters['path']['value'], dt.strftime(self.date_time, '%d.%m.%Y %H:%M:%S'))
+            info = "Current:\n {:s}\n{:s} UT".format(self.__parameters['path']['value'], self.__date_time_str)
         return "This class provides read and plot ionogram in DAT-format\n{:s}".format(info)
 
+    @property
+    def noise(self):
+        """
+        Шум в виде массива строк [ifn, amp]
+        """
+        return np.column_stack((self.noise_fn, self.noise_amp))
+
+    @property
+    def echoes(self):
+        """
+        Отражения в виде массива строк [ifn, it, amp]
+        """
+        return np.column_stack((self.echo_fn, self.echo_it, self.echo_amp))
+
     def __eq__(self, other):
         res = bool(1)
-        if(len(self.noise) != len(other.noise)):
+        if(self.noise_amp.size != other.noise_amp.size):
             res = bool(0)
         if(self.__parameters['freq0']['value'] != other.__parameters['freq0']['value']):
             res = bool(0)
@@ -111,100 +154,85 @@ class Ionogram():
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __clone(self):
+        """
+        Копия для арифметических операций: копируются только массивы шума и отражений,
+        кэши матриц сбрасываются, остальные атрибуты разделяются с исходным объектом
+        """
+        c = Ionogram.__new__(Ionogram)
+        c.__dict__.update(self.__dict__)
+        c.__parameters = copy.deepcopy(self.__parameters)
+        c.noise_fn = self.noise_fn.copy()
+        c.noise_amp = self.noise_amp.copy()
+        c.echo_fn = self.echo_fn.copy()
+        c.echo_it = self.echo_it.copy()
+        c.echo_amp = self.echo_amp.copy()
+        c.ionogram_matrix = None
+        c.medfilt2d = None
+        c.cellular_automaton = None
+        return c
+
+    def __itruediv__(self, scalar):
+        index_max = np.argmax(self.echo_it)
+        self.noise_amp = np.maximum(self.noise_amp - 20*np.log10( scalar ), 0)
+        self.echo_amp = self.echo_amp - 20*np.log10( scalar )
+        self.echo_amp[index_max] = 1
+        self.echo_amp[self.echo_amp < 0] = np.nan
+        self.ionogram_matrix = None
+        self.medfilt2d = None
+        self.cellular_automaton = None
+        return self
+
     def __truediv__(self, scalar):
-        c = copy.deepcopy(self)
-        index_max = np.argmax(np.array(c.echoes)[:, 1])
-        for i,e in enumerate(c.noise):
-            c.noise[i][1] -= 20*np.log10( scalar )
-            if(c.noise[i][1] < 0):
-                # print('WARNING: The noise become negative!')
-                c.noise[i][1] = 0
-        for i,e in enumerate(c.echoes):
-            # c.echoes[i][2] -= 20*np.log10( scalar )
-            if(i != index_max):
-                c.echoes[i][2] -= 20*np.log10( scalar )
-            else:
-                c.echoes[i][2] = 1
-            if(c.echoes[i][2] < 0):
-                # print('WARNING: The amplitude become negative!')
-                c.echoes[i][2] = np.nan
+        c = Ionogram.__clone(self)
+        c /= scalar
         return c
 
     def __iadd__(self, other):
-        for i,e in enumerate(other.noise):
-            self.noise[i][1] = 20*np.log10( 10**(self.noise[i][1]/20) + 10**(e[1]/20) )
-            # print(i,e)
-        for i,e in enumerate(other.echoes):    
-            echoe_exist = bool(0)            
-            for i1,e1 in enumerate(self.echoes): 
-                if(e1[:2] == e[:2]):
-                    # print(e, e1)
-                    self_amp = 10**(e1[2]/20)
-                    other_amp = 10**(e[2]/20)
-                    # self.echoes[i1][2] = 20*np.log10( self_amp + other_amp )
-                    
-                    sum_value = 20*np.log10( self_amp + other_amp )
-                    # print(e1[1])
-                    if(sum_value > self.noise[e1[0]][1]):
-                        self.echoes[i1][2] = sum_value
-                    else:
-                        self.echoes.pop(i1)
-                        
-                    echoe_exist = bool(1)
-                    break
-            if(not echoe_exist):
-                # self.echoes.append([e[0], e[1], e[2]])
-
-                if(e[2] > self.noise[e[0]][1]):
-                        self.echoes.append([e[0], e[1], e[2]])
-        # print(len(self.echoes))
+        # Сложение амплитуд в дБ: 20*log10(10**(a/20) + 10**(b/20))
+        db = np.log(10) / 20
+        self.noise_amp = np.logaddexp(self.noise_amp*db, other.noise_amp*db) / db
+        # Совпадающие отражения ищутся по ключу (ifn << 16) | it
+        key_self = (self.echo_fn.astype(np.uint32) << 16) | self.echo_it.astype(np.uint32)
+        key_other = (other.echo_fn.astype(np.uint32) << 16) | other.echo_it.astype(np.uint32)
+        order = np.argsort(key_self, kind='stable')
+        key_sorted = key_self[order]
+        pos = np.searchsorted(key_sorted, key_other)
+        matched = pos < key_sorted.size
+        matched[matched] = key_sorted[pos[matched]] == key_other[matched]
+        idx = order[pos[matched]]
+        sum_value = np.logaddexp(self.echo_amp[idx]*db, other.echo_amp[matched]*db) / db
+        above = sum_value > self.noise_amp[self.echo_fn[idx]]
+        echo_amp = self.echo_amp.copy()
+        echo_amp[idx[above]] = sum_value[above]
+        keep = np.ones(key_self.size, dtype=bool)
+        keep[idx[~above]] = False
+        new = ~matched
+        new[new] = other.echo_amp[new] > self.noise_amp[other.echo_fn[new]]
+        self.echo_fn = np.concatenate((self.echo_fn[keep], other.echo_fn[new]))
+        self.echo_it = np.concatenate((self.echo_it[keep], other.echo_it[new]))
+        self.echo_amp = np.concatenate((echo_amp[keep], other.echo_amp[new]))
+        self.ionogram_matrix = None
+        self.medfilt2d = None
+        self.cellular_automaton = None
         return self
 
     def __add__(self, other):
-        c = copy.deepcopy(self)
-        for i,e in enumerate(other.noise):
-            c.noise[i][1] = 20*np.log10( 10**(c.noise[i][1]/20) + 10**(e[1]/20) )
-        for i,e in enumerate(other.echoes):    
-            echoe_exist = bool(0)            
-            for i1,e1 in enumerate(c.echoes): 
-                if(e1[:2] == e[:2]):
-                    a_amp = 10**(e1[2]/20)
-                    other_amp = 10**(e[2]/20)
-                    # c.echoes[i1][2] = 20*np.log10( a_amp + other_amp )
-                    
-                    sum_value = 20*np.log10( a_amp + other_amp )
-                    if(sum_value > c.noise[e1[0]][1]):
-                        c.echoes[i1][2] = sum_value
-                    else:
-                        c.echoes.pop(i1)
-                        
-                    echoe_exist = bool(1)
-                    break
-            if(not echoe_exist):
-                # c.echoes.append([e[0], e[1], e[2]])
-
-                if(e[2] > c.noise[e[0]][1]):
-                        c.echoes.append([e[0], e[1], e[2]])
+        c = Ionogram.__clone(self)
+        c += other
         return c
 
     def __get_param(self, parname):
         return self.__parameters[parname]['value']
 
     def get_passport(self):
-        p = ''
-        for par in self.__parameters:
-            p += '{:s}:'.format(self.__parameters[par]['description'])
-            if('s' in self.__parameters[par]['type']):
-                p += ' {:s}'.format(self.__parameters[par]['value'])
-            if('f' in self.__parameters[par]['type']):
-                p += ' {:.4f}'.format(self.__parameters[par]['value'])
-            if('d' in self.__parameters[par]['type']):
-                p += ' {:d}'.format(self.__parameters[par]['value'])
-            if(self.__parameters[par]['units'] != ''):
-                p += ' {:s}'.format(self.__parameters[par]['units'])
-            p += "\n"
-        p += "\n"
-        return p
+        if(self.__passport_cache is None):
+            self.__passport_cache = ''.join(
+                '{:s}:'.format(par['description']) + par['fmt'].format(par['value'])
+                + (' {:s}'.format(par['units']) if par['units'] != '' else '') + "\n"
+                for par in self.__parameters.values()
+            ) + "\n"
+        return self.__passport_cache
 
     def print_passport(self):
         p = Ionogram.get_passport(self)
@@ -216,9 +244,8 @@ class Ionogram():
         filename - путь к "dat"-файлу
         """
         if(filename is not None):
-            f = open(filename, mode="rb")
-            self.readion_binary(f)
-            f.close()
+            with open(filename, mode="rb") as f:
+                self.readion_binary(f)
         else:
             print('You should indicate ionogram filename to read!')
 
@@ -228,17 +255,21 @@ class Ionogram():
         binarydata - объект BinaryIO
         """
         self.__data = binarydata.read()
-        b = self.__data.decode('cp866')
-        self.__passport = b[:b.find(self.__delimeter)]
-        self.__ionogram = self.__data[b.find(self.__delimeter) + 4:]
+        # cp866 однобайтовая: ищем разделитель в байтах и декодируем только паспорт
+        idx = self.__data.find(self.__delimeter.encode('cp866'))
+        self.__passport = self.__data[:idx].decode('cp866')
+        # Данные ионограммы не копируются: запоминается только смещение в прочитанном буфере
+        self.__ionogram_offset = idx + 4
         Ionogram.__parse_passport(self)
         Ionogram.__parse_ionogram(self)
         # self.nheights = Ionogram.get_dimension(self)
-        self.imaxheight = np.max(np.array(self.echoes)[:, 1])
+        self.imaxheight = int(np.max(self.echo_it))
         self.nheights = self.imaxheight+1
         self.dheight = self.maxheight / self.imaxheight / 1000
+        self.__frequences = None
+        self.__heights = None
         self.__ionogram_loaded = True
-        if(np.array(self.noise).size == 0):
+        if(self.noise_amp.size == 0):
             print('WARNING: Ionogram does not contain noise data')
             
     def writeion(self, filename: str = None, rewrite=False):
@@ -260,40 +291,54 @@ class Ionogram():
                 f.write(b)
                 f.write(bytearray(self.__delimeter, 'cp866'))
                 
-                amp = Ionogram.get_ionogram(self)
-                noise = np.array(self.noise)
-                # print(noise)
-                # return
-                for ifn in range(self.nfrequences):
-                    f.write((ifn+1 | 32768).to_bytes(2, 'big'))
-                    f.write(Ionogram.__align.to_bytes(2, 'big'))
-                    # print(noise[ifn, 1])
-                    f.write(int(noise[ifn, 1].item()).to_bytes(2, 'big'))
-                    f.write(Ionogram.__align.to_bytes(2, 'big'))
-                    for it in range(self.nheights):
-                        if(~np.isnan(amp[it, ifn])):
-                            f.write(int(amp[it, ifn].item()).to_bytes(2, 'big'))
-                            f.write(it.to_bytes(2, 'big'))
+                # Отражения, упорядоченные по частоте, затем по высоте
+                valid = ~np.isnan(self.echo_amp) & (self.echo_it < self.nheights) & (self.echo_fn >= 0) & (self.echo_fn < self.nfrequences)
+                fn = self.echo_fn[valid]
+                it = self.echo_it[valid]
+                order = np.lexsort((it, fn))
+                fn = fn[order]
+                it = it[order]
+                amp = self.echo_amp[valid][order]
+
+                # На каждую частоту: заголовок, выравнивание, шум, выравнивание, затем пары (амплитуда, высота)
+                counts = np.bincount(fn, minlength=self.nfrequences)
+                first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                starts = 4*np.arange(self.nfrequences) + 2*first
+                words = np.empty(4*self.nfrequences + 2*fn.size, dtype='>u2')
+                words[starts] = (np.arange(self.nfrequences) + 1) | Ionogram.__cluster_flag
+                words[starts + 1] = Ionogram.__align
+                words[starts + 2] = self.noise_amp[:self.nfrequences].astype(np.int64)
+                words[starts + 3] = Ionogram.__align
+                pos = starts[fn] + 4 + 2*(np.arange(fn.size) - first[fn])
+                words[pos] = amp.astype(np.int64)
+                words[pos + 1] = it
+                f.write(words.tobytes())
                 f.close()
         else:
             print('You should indicate ionogram filename to write!')
 
     def __parse_passport(self):
+        desc2key = {self.__parameters[par]['description']: par for par in self.__parameters}
         for v in self.__passport.splitlines():
-            for par in self.__parameters:
-                if(v.find(self.__parameters[par]['description']) != -1):
-                    idx1 = v.index(": ") + 2
-                    if('s' in self.__parameters[par]['type']):
+            par = desc2key.get(v.split(':', 1)[0].strip())
+            if(par is not None):
+                pars = (par,)
+            else:
+                # Строка нестандартного вида: ищем описание параметра в строке целиком
+                pars = [par for par in self.__parameters if v.find(self.__parameters[par]['description']) != -1]
+            for par in pars:
+                idx1 = v.index(": ") + 2
+                if('s' in self.__parameters[par]['type']):
+                    self.__parameters[par]['value'] = v[idx1:].strip()
+                else:
+                    while(v[idx1:].find(" ") == 0):
+                        idx1 += 1
+                    if(v[idx1:].find(" ") == -1):
                         self.__parameters[par]['value'] = v[idx1:].strip()
                     else:
-                        while(v[idx1:].find(" ") == 0):
-                            idx1 += 1
-                        if(v[idx1:].find(" ") == -1):
-                            self.__parameters[par]['value'] = v[idx1:].strip()
-                        else:
-                            idx2 = v[idx1:].index(" ")
-                            self.__parameters[par]['value'] = v[idx1: idx1 + 1 + idx2].strip()
-                            self.__parameters[par]['units'] = v[idx1 + idx2 + 1:].strip()
+                        idx2 = v[idx1:].index(" ")
+                        self.__parameters[par]['value'] = v[idx1: idx1 + 1 + idx2].strip()
+                        self.__parameters[par]['units'] = v[idx1 + idx2 + 1:].strip()
         
         Ionogram.__parse_date_time(self)
         
@@ -309,39 +354,41 @@ class Ionogram():
             self.maxheight = Ionogram.light_velocity * self.__parameters['band_width']['value']                                 / self.__parameters['chirp_rate']['value'] / 1000
         else:
             self.maxheight = Ionogram.light_velocity * self.__parameters['band_width']['value']                                 / self.__parameters['chirp_rate']['value'] / 2.0 / 1000
+        self.__passport_cache = None
         
     def __parse_date_time(self):
         dt_string = '{:s} {:s}'.format(self.__parameters['date']['value'], self.__parameters['time']['value'][0:8])
         self.date_time = dt.strptime(dt_string, '%d.%m.%Y %H:%M:%S')
+        self.__date_time_str = dt.strftime(self.date_time, '%d.%m.%Y %H:%M:%S')
 
-    def __check_new_cluster(value, flag):
-        result = (int.from_bytes(value[0:1],'big') & int.from_bytes(flag, 'big')).to_bytes(max(len(value[0:1]), len(flag)), 'big')
-        if(result == flag):
-            return True
-        return False
-            
     def __parse_ionogram(self):
-        ifn_ = -1
-        for ib in np.arange(0,len(self.__ionogram),4):
-            if(Ionogram.__check_new_cluster(self.__ionogram[ib:ib+2], Ionogram.__cluster_flag)):
-                ifn = int.from_bytes(self.__ionogram[ib:ib+2], 'big') & 32767          
-                ifn_ += 1
-                if(int.from_bytes(self.__ionogram[ib+2:ib+4], 'big') != 1):
-                    print('ERROR in align!')
-            else:
-                amp = int.from_bytes(self.__ionogram[ib:ib+2], 'big')
-                it  = int.from_bytes(self.__ionogram[ib+2:ib+4], 'big')
-                # print(ifn_, it, amp)
-                if(it == 1):
-                    self.noise.append([ifn_, amp])
-                else:
-                    self.echoes.append([ifn_, it, amp])
+        # Записи по 4 байта: два big-endian uint16 (амплитуда/заголовок кластера, высота/выравнивание)
+        nrecords = (len(self.__data) - self.__ionogram_offset) // 4
+        raw = np.frombuffer(self.__data, dtype='>u2', count=nrecords * 2, offset=self.__ionogram_offset).reshape(-1, 2)
+        is_hdr = (raw[:, 0] & Ionogram.__cluster_flag) != 0
+        if(np.any(raw[is_hdr, 1] != Ionogram.__align)):
+            print('ERROR in align!')
+        ifn_idx = np.cumsum(is_hdr) - 1
+        data_mask = ~is_hdr
+        fn = ifn_idx[data_mask]
+        it = raw[data_mask, 1]
+        amp = raw[data_mask, 0]
+        noise_mask = (it == 1)
+        self.noise_fn = fn[noise_mask].astype(np.int32)
+        self.noise_amp = amp[noise_mask].astype(np.float64)
+        self.echo_fn = fn[~noise_mask].astype(np.int32)
+        self.echo_it = it[~noise_mask].astype(np.int32)
+        self.echo_amp = amp[~noise_mask].astype(np.float64)
 
     def get_frequences(self):
-        return np.array([(self.__parameters['freq0']['value'] + i * self.__parameters['freq_step']['value'])                          / 1000 for i in range(self.nfrequences + 1)])
+        if(self.__frequences is None):
+            self.__frequences = (self.__parameters['freq0']['value'] + np.arange(self.nfrequences + 1) * self.__parameters['freq_step']['value']) / 1000
+        return self.__frequences
     
     def get_heights(self):
-        return np.array([self.first_delay + i * self.dheight for i in range(self.nheights + 1)])
+        if(self.__heights is None):
+            self.__heights = self.first_delay + np.arange(self.nheights + 1) * self.dheight
+        return self.__heights
         # return np.array([self.first_delay + (i - 1) * self.dheight for i in range(self.nheights + 1)]) #This is for corespondence with Grozov&Ponomarchuk programs
 
     def get_dimension(self):
@@ -361,56 +408,53 @@ class Ionogram():
     #     return self.ionogram_matrix
     
     def get_ionogram(self, recalc=False):
-        if(not np.any(self.ionogram_matrix) or recalc):
+        if(self.ionogram_matrix is None or recalc):
             # print('Recalculating self.ionogram_matrix')
+            mask = self.echo_it < self.nheights
             self.ionogram_matrix = np.full((self.nheights, self.nfrequences,), fill_value=np.nan, dtype=np.float64)
-            for x in self.echoes:
-                if(x[1] < self.nheights):
-                    self.ionogram_matrix[x[1], x[0]] = x[2]
+            self.ionogram_matrix[self.echo_it[mask], self.echo_fn[mask]] = self.echo_amp[mask]
         return self.ionogram_matrix
     
     def do_medfilt2d(self, size=3, order=1, recalc=False):
         """
         Медианный 2D фильтр для удаления шумов
         """
-        if(not np.any(self.medfilt2d) or recalc):
+        if(self.medfilt2d is None or recalc):
             # print('Recalculating self.medfilt2d')
-            echoes_to_filt = np.copy(self.get_ionogram(recalc=recalc))
-            echoes_to_filt[np.isnan(echoes_to_filt)] = 0
-            for i in range(order):
-                self.medfilt2d = sc.signal.medfilt2d(echoes_to_filt, kernel_size=size)
-                echoes_to_filt = np.copy(self.medfilt2d)
+            echoes_to_filt = np.nan_to_num(self.get_ionogram(recalc=recalc), nan=0.0)
+            if(np.max(size) >= 7):
+                # Для больших окон ndimage.median_filter быстрее; два буфера используются поочерёдно
+                out = np.empty_like(echoes_to_filt)
+                for i in range(order):
+                    sc.ndimage.median_filter(echoes_to_filt, size=size, mode='constant', cval=0.0, output=out)
+                    echoes_to_filt, out = out, echoes_to_filt
+            else:
+                for i in range(order):
+                    echoes_to_filt = sc.signal.medfilt2d(echoes_to_filt, kernel_size=size)
+            self.medfilt2d = echoes_to_filt
         return self.medfilt2d
 
     def do_cellular_automaton(self, freq_size=3, height_size=3, recalc=False):
         """
         Клеточный автомат для выделения точек со значимой амплитудой
         """
-        if(not np.any(self.cellular_automaton) or recalc):
+        if(self.cellular_automaton is None or recalc):
             # print('Recalculating self.cellular_automaton')
             echoes_tmp = self.do_medfilt2d(size=3, order=1, recalc=recalc)
-            cellular = []
             norm = 1.0 / freq_size / height_size
             aver_amp_array = sc.ndimage.uniform_filter(echoes_tmp, size=[height_size, freq_size], mode='constant')
-            for i,f in enumerate(self.get_frequences()[:-1]):
-                row_3s = 3.0*np.std(echoes_tmp[:,max(i-1,0):min(i-1+freq_size,echoes_tmp.shape[1])])
-                cmax_amp = 0
-                incr_flag = True                
-                for j,h in enumerate(self.get_heights()[:-1]):
-                    if(aver_amp_array[j, i] > row_3s):
-                        if(cmax_amp <= aver_amp_array[j, i]):
-                            incr_flag = True
-                            cmax_amp = aver_amp_array[j, i]
-                        else:
-                            if(incr_flag and echoes_tmp[j, i] != 0):
-                                cellular.append([i, j, int(echoes_tmp[j, i])])
-                                incr_flag = False
-                    else:
-                        cmax_amp = 0
+            # 3 СКО по окну столбцов [i-1, i-1+freq_size) через накопленные суммы
+            ncols = echoes_tmp.shape[1]
+            cs = np.concatenate(([0.0], np.cumsum(echoes_tmp.sum(axis=0))))
+            cs2 = np.concatenate(([0.0], np.cumsum((echoes_tmp**2).sum(axis=0))))
+            cols = np.arange(ncols)
+            a = np.maximum(cols - 1, 0)
+            b = np.minimum(cols - 1 + freq_size, ncols)
+            count = (b - a) * echoes_tmp.shape[0]
+            mean = (cs[b] - cs[a]) / count
+            row_3s = 3.0*np.sqrt(np.maximum((cs2[b] - cs2[a]) / count - mean**2, 0))
             self.cellular_automaton = np.full((self.nheights, self.nfrequences,), fill_value=np.nan, dtype=np.float64)
-            for x in cellular:
-                if(x[1] < self.nheights):
-                    self.cellular_automaton[x[1], x[0]] = x[2]      
+            _ca_scan(aver_amp_array, echoes_tmp, row_3s, self.cellular_automaton)
         return self.cellular_automaton
                 
     def plot_ionogram(self, mode=None, ax=None, freq_min=None, freq_max=None, height_min=None, height_max=None, title=True, fontsize=16):
@@ -457,7 +501,7 @@ class Ionogram():
         if(self.__parameters['mode'] == 'ВЗ'):
             ax.set_ylabel( 'virtual height, km', fontsize=fontsize )
         y1 = self.first_delay
-        y2 = np.nanmax(y)
+        y2 = y[-1]
         if(height_min is not None):
             y1 = height_min
         if(height_max is not None):
@@ -468,8 +512,8 @@ class Ionogram():
         
         ax.set_xlabel( 'frequency, MHz', fontsize=fontsize )
         
-        x1 = np.nanmin(x)
-        x2 = np.nanmax(x)
+        x1 = x[0]
+        x2 = x[-1]
         if(freq_min is not None):
             x1 = freq_min
         if(freq_max is not None):
@@ -479,7 +523,7 @@ class Ionogram():
         ax.set_xticks(np.arange(x1, x2, 1))
         
         if(title):
-            pictitle = '{:s}{:s}\n{:s} UT'.format(self.__parameters['path']['value'], title_mode, dt.strftime(self.date_time, '%d.%m.%Y %H:%M:%S'))
+            pictitle = '{:s}{:s}\n{:s} UT'.format(self.__parameters['path']['value'], title_mode, self.__date_time_str)
             # plt.suptitle(pictitle, y=0.94, fontsize=16, fontdict={'weight': 'normal'})
             ax.set_title(pictitle, fontsize=fontsize, fontdict={'weight': 'normal'})
             
@@ -487,9 +531,10 @@ class Ionogram():
         ax.xaxis.set_minor_locator(AutoMinorLocator(5))
         ax.yaxis.set_minor_locator(AutoMinorLocator(5))
         
-        cp = ax.pcolormesh(x, y, z, cmap='jet', vmin = np.nanmin(z), vmax = np.nanmax(z))
+        zmin, zmax = np.nanmin(z), np.nanmax(z)
+        cp = ax.pcolormesh(x, y, z, cmap='jet', vmin = zmin, vmax = zmax)
 
-        cbar = plt.colorbar(cp, ax=ax, cax=axins, ticks = np.arange(np.nanmin(z), np.nanmax(z), 10))
+        cbar = plt.colorbar(cp, ax=ax, cax=axins, ticks = np.arange(zmin, zmax, 10))
         cbar.ax.set_title('Amplitude, dB', fontdict = {'fontsize': fontsize, 'fontweight': 'normal'}, pad = 10)
         cbar.ax.tick_params(labelsize = (fontsize - 2))
 
@@ -502,7 +547,7 @@ class Ionogram():
         freq_max - правая граница на оси частот
         title - флаг вывода подзаголовка (True/False - c/без заголовка)
         """
-        y = np.array(self.noise)
+        y = self.noise_amp
         x = self.get_frequences()
 
         if(y.size == 0):
@@ -515,8 +560,8 @@ class Ionogram():
         ax.set_ylabel( 'noise, dB?', fontsize=fontsize )
         ax.set_xlabel( 'frequency, MHz', fontsize=fontsize )
         
-        x1 = np.nanmin(x)
-        x2 = np.nanmax(x)
+        x1 = x[0]
+        x2 = x[-1]
         if(freq_min is not None):
             x1 = freq_min
         if(freq_max is not None):
@@ -526,17 +571,17 @@ class Ionogram():
         ax.set_xticks(np.arange(x1, x2, 1))
             
         if(title):
-            pictitle = '{:s} {:s} UT'.format(self.__parameters['path']['value'], dt.strftime(self.date_time, '%d.%m.%Y %H:%M:%S'))
+            pictitle = '{:s} {:s} UT'.format(self.__parameters['path']['value'], self.__date_time_str)
             plt.suptitle(pictitle, y=1, fontsize=fontsize, fontdict={'weight': 'normal'})
         ax.tick_params(axis='both', which='both', labelsize=(fontsize - 2), direction='in', length=5)
         ax.xaxis.set_minor_locator(AutoMinorLocator(5))
 
-        ax.plot(x[:-1], y[:,1], 'bo', label='', markersize=2)
+        ax.plot(x[:-1], y, 'bo', label='', markersize=2)
         ax.grid(which='major', axis='both', linestyle = ':', color="black")
 
     def plot_ionogram_rect(self, ax=None, freq_min=None, freq_max=None, height_min=None, height_max=None, title=True, fontsize=16):
         """
-        Функция построения графика ионограммы (патчами - прямоугольниками)
+        Функция построения графика ионограммы (ячейками сетки - прямоугольниками)
         ax - идентификатор осей координат
         freq_min - левая граница на оси частот
         freq_max - правая граница на оси частот
@@ -544,7 +589,7 @@ class Ionogram():
         height_max - верхняя граница на оси высот/дальности
         title - флаг вывода подзаголовка (True/False - c/без заголовка)
         """
-        z = self.get_raw_ionogram()
+        z = np.ma.masked_invalid(self.get_ionogram())
         x = self.get_frequences()
         y = self.get_heights()
         
@@ -565,7 +610,7 @@ class Ionogram():
         if(self.__parameters['mode'] == 'ВЗ'):
             ax.set_ylabel( 'virtual height, km', fontsize=fontsize )
         y1 = self.first_delay
-        y2 = np.nanmax(y)
+        y2 = y[-1]
         if(height_min is not None):
             y1 = height_min
         if(height_max is not None):
@@ -576,8 +621,8 @@ class Ionogram():
         
         ax.set_xlabel( 'frequency, MHz', fontsize=fontsize )
         
-        x1 = np.nanmin(x)
-        x2 = np.nanmax(x)
+        x1 = x[0]
+        x2 = x[-1]
         if(freq_min is not None):
             x1 = freq_min
         if(freq_max is not None):
@@ -587,7 +632,7 @@ class Ionogram():
         ax.set_xticks(np.arange(x1, x2, 1))
         
         if(title):
-            pictitle = '{:s}\n{:s} UT'.format(self.__parameters['path']['value'], dt.strftime(self.date_time, '%d.%m.%Y %H:%M:%S'))
+            pictitle = '{:s}\n{:s} UT'.format(self.__parameters['path']['value'], self.__date_time_str)
             plt.suptitle(pictitle, y=0.94, fontsize=fontsize, fontdict={'weight': 'normal'})
             
         ax.tick_params(axis='both', which='both', labelsize=(fontsize - 2), direction='in', length=5)
@@ -595,15 +640,11 @@ class Ionogram():
         ax.yaxis.set_minor_locator(AutoMinorLocator(5))
 
         cmap = ListedColormap(plt.get_cmap('jet')(np.linspace(0, 1, 256)))  # skip too light colors
-        amplitudes = np.array([e[2] for e in z])
-        norm = plt.Normalize(amplitudes.min(), amplitudes.max())
-        echoes_rect = [Rectangle((x[e[0]], y[e[1]]), self.__parameters['freq_step']['value'] / 1000, self.maxheight / self.imaxheight / 1000, color=cmap(norm(e[2]))) for e in z]
-        echoes_color = [cmap(norm(e[2])) for e in z]
-
-        pc = PatchCollection(echoes_rect, facecolor=echoes_color, alpha=1.0)
-        ax.add_collection(pc)
+        norm = plt.Normalize(z.min(), z.max())
+        # Ячейки сетки частота x высота рисуются одним QuadMesh, пустые ячейки замаскированы
+        pc = ax.pcolormesh(x, y, z, cmap=cmap, norm=norm, shading='flat')
 
-        cbar = plt.colorbar(ScalarMappable(cmap=cmap, norm=norm), ax=ax, cax=axins, ticks = np.arange(np.nanmin(amplitudes), np.nanmax(amplitudes), 10))
+        cbar = plt.colorbar(pc, ax=ax, cax=axins, ticks = np.arange(norm.vmin, norm.vmax, 10))
         cbar.ax.set_title('Amplitude, dB', fontdict = {'fontsize': fontsize, 'fontweight': 'normal'}, pad = 10)
         cbar.ax.tick_params(labelsize = (fontsize - 2))
 
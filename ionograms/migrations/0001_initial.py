@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-15 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IonogramFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(db_index=True, max_length=255)),
+                ('file_path', models.CharField(max_length=512)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['uploaded_at'], name='ionograms_i_uploade_2c6b0f_idx')],
+            },
+        ),
+    ]
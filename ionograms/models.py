@@ -2,9 +2,14 @@ from django.db import models
 
 # Create your models here.
 class IonogramFile(models.Model):
-    file_name = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255, db_index=True)
     file_path = models.CharField(max_length=512)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['uploaded_at']),
+        ]
+
     def __str__(self):
         return self.file_name
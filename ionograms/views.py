@@ -1,11 +1,38 @@
 import os
+import io
+import stat
+import base64
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from django.shortcuts import render
 import plotly.graph_objects as go
+import plotly.io as pio
+import plotly.colors as pc
 import numpy as np
+from matplotlib.colors import LinearSegmentedColormap
+from PIL import Image
 from ion_class import Ionogram
 from datetime import datetime
 from django.http import JsonResponse
-import glob
+
+# Сериализация графиков в JSON через orjson (C-кодировщик) вместо json из stdlib
+pio.json.config.default_engine = 'orjson'
+
+# plotly.js подключается с CDN, а не встраивается (~3 МБ) в каждый график.
+# Тег <script> с CDN добавляется только в ионограмму: график шума идёт на странице после неё
+PLOTLY_HTML_OPTIONS = dict(
+    include_mathjax=False,
+    config={'displaylogo': False, 'responsive': True},
+)
+
+# Палитра 'jet' из Plotly: картинка ионограммы и шкала амплитуд должны раскрашиваться одинаково
+# (jet из matplotlib заметно отличается от одноимённой шкалы Plotly)
+JET_COLORSCALE = pc.get_colorscale('jet')
+JET_CMAP = LinearSegmentedColormap.from_list(
+    'plotly_jet',
+    [(t, [c / 255 for c in pc.unlabel_rgb(color)]) for t, color in JET_COLORSCALE],
+    N=1024,
+)
 
 def list_files(request):
     base_path = request.GET.get('path', 'C:/Users/Сергей/ions_fizika/ions_ser/vs')
@@ -16,30 +43,30 @@ def list_files(request):
     error = None
 
     try:
-        items = os.listdir(base_path)
         dirs = []
         dat_files = []
 
-        for item in items:
-            item_path = os.path.join(base_path, item)
-            if os.path.isdir(item_path):
-                dirs.append(item)
-            elif item.endswith('.dat'):
-                dat_files.append(item)
+        # DirEntry хранит тип записи, поэтому отдельный stat на каждый элемент не нужен
+        with os.scandir(base_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.name.endswith('.dat'):
+                    dat_files.append(entry.name)
     except Exception as e:
         dirs = []
         dat_files = []
         error = str(e)
 
     if selected_file:
-        file_path = os.path.join(base_path, selected_file)
-        if os.path.isfile(file_path):
+        file_path = os.path.abspath(os.path.join(base_path, selected_file))
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            st = None
+        if st is not None and stat.S_ISREG(st.st_mode):
             try:
-                ion = Ionogram()
-                ion.readion(file_path)
-                passport = ion.get_passport()
-                ionogram_html = generate_ionogram(ion)
-                noise_html = generate_noise_plot(ion)
+                passport, ionogram_html, noise_html = render_ionogram(file_path, st.st_mtime_ns, st.st_size)
             except Exception as e:
                 error = f"Невозможно построить ионограмму: {str(e)}"
 
@@ -57,6 +84,41 @@ def list_files(request):
         'error': error
     })
 
+@lru_cache(maxsize=32)
+def render_ionogram(file_path, mtime_ns, size):
+    """
+    Чтение ионограммы и построение графиков с кэшированием
+    mtime_ns и size входят в ключ кэша, поэтому изменённый файл будет прочитан заново
+    Возвращает (паспорт, html ионограммы, html шума)
+    """
+    ion = Ionogram()
+    ion.readion(file_path)
+    # Графики независимы, строятся параллельно
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_ion = ex.submit(generate_ionogram, ion)
+        f_noise = ex.submit(generate_noise_plot, ion)
+        return ion.get_passport(), f_ion.result(), f_noise.result()
+
+def iter_dat_files(root, prefix):
+    """
+    Рекурсивный обход каталога root: выдаёт пути к .dat-файлам, имена которых начинаются с prefix
+    Скрытые и недоступные каталоги пропускаются, как и в glob
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.startswith(prefix) and entry.name.endswith('.dat'):
+                    yield entry.path
+
 def get_files_by_date(request):
     if request.method == 'GET' and 'date' in request.GET:
         date_str = request.GET['date']
@@ -65,27 +127,46 @@ def get_files_by_date(request):
             month = f"{date.month:02d}"
             day = f"{date.day:02d}"
 
-            all_dat_files = glob.glob('C:/Users/Сергей/ions_fizika/**/*.dat', recursive=True)
-
             matched_files = []
-            for file_path in all_dat_files:
+            for file_path in iter_dat_files('C:/Users/Сергей/ions_fizika', f"{month}_{day}_"):
                 filename = os.path.basename(file_path)
                 if filename.count('_') >= 4:
-                    try:
-                        file_month, file_day, _, _, _ = filename.split('_')[:5]
-                        if file_month == month and file_day == day:
-                            matched_files.append({
-                                'path': os.path.dirname(file_path),
-                                'file': filename
-                            })
-                    except:
-                        continue
+                    matched_files.append({
+                        'path': os.path.dirname(file_path),
+                        'file': filename
+                    })
 
             return JsonResponse({'files': matched_files})
         except ValueError:
             return JsonResponse({'error': 'Invalid date format'}, status=400)
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+def block_reduce(z, x, y, height=600, width=800):
+    """
+    Прореживание матрицы амплитуд до разрешения графика (height x width точек)
+    В блоке берётся максимум без учёта NaN, чтобы не терялись отдельные отражения
+    x, y - границы ячеек по частоте и высоте, прореживаются так же
+    """
+    ky = max(1, z.shape[0] // height)
+    kx = max(1, z.shape[1] // width)
+    if ky == 1 and kx == 1:
+        return z, x, y
+    h2 = z.shape[0] // ky * ky
+    w2 = z.shape[1] // kx * kx
+    blocks = z[:h2, :w2].reshape(h2 // ky, ky, w2 // kx, kx)
+    z = np.fmax.reduce(np.fmax.reduce(blocks, axis=3), axis=1)
+    return z, x[:w2 + 1:kx], y[:h2 + 1:ky]
+
+def amplitude_png(z, zmin, zmax):
+    """
+    Кодирует матрицу амплитуд в PNG (data URI) с палитрой 'jet' Plotly, пустые ячейки (NaN) прозрачные
+    """
+    span = (zmax - zmin) or 1.0
+    rgba = JET_CMAP(np.clip((z - zmin) / span, 0, 1), bytes=True)
+    buf = io.BytesIO()
+    Image.fromarray(rgba).save(buf, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
 def generate_ionogram(ion):
     z = ion.get_ionogram()
     x = ion.get_frequences()
@@ -93,24 +174,42 @@ def generate_ionogram(ion):
     path_value = ion._Ionogram__parameters['path']['value']
     mode_value = ion._Ionogram__parameters['mode']['value']
     date_time = ion.date_time
+    zmin, zmax = np.nanmin(z), np.nanmax(z)
+    z, x, y = block_reduce(z, x, y)
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
 
     fig = go.Figure()
+    # Ионограмма передаётся одной PNG-картинкой вместо JSON-матрицы Heatmap
     fig.add_trace(
-        go.Heatmap(
-            x=x, y=y, z=z,
-            colorscale='jet',
-            zmin=np.nanmin(z),
-            zmax=np.nanmax(z),
-            colorbar=dict(title='Amplitude, dB'),
+        go.Image(
+            source=amplitude_png(z, zmin, zmax),
+            x0=x[0] + dx / 2, dx=dx,
+            y0=y[0] + dy / 2, dy=dy,
             name='Ionogram',
             hovertemplate=(
                 'Frequency: %{x:.2f} MHz<br>'
                 'Range: %{y:.2f} km<br>'
-                'Amplitude: %{z:.2f} dB<br>'
                 '<extra></extra>'
             )
         )
     )
+    # Пустой trace только для шкалы амплитуд
+    fig.add_trace(
+        go.Scatter(
+            x=[None], y=[None],
+            mode='markers',
+            marker=dict(
+                colorscale=JET_COLORSCALE,
+                cmin=zmin,
+                cmax=zmax,
+                showscale=True,
+                colorbar=dict(title='Amplitude, dB')
+            ),
+            hoverinfo='skip',
+            showlegend=False
+        )
+    )
 
     fig.update_layout(
         title=f"{path_value}<br>{date_time.strftime('%d.%m.%Y %H:%M:%S')} UT",
@@ -124,7 +223,7 @@ def generate_ionogram(ion):
     )
 
     fig.update_xaxes(
-        range=[np.nanmin(x), 10],
+        range=[x[0], 10],
         dtick=1,
         minor=dict(ticklen=4, dtick=0.2),
         showgrid=True,
@@ -132,7 +231,8 @@ def generate_ionogram(ion):
         gridcolor='LightGrey'
     )
     fig.update_yaxes(
-        range=[np.nanmin(y), np.nanmax(y)],
+        range=[y[0], y[-1]],
+        scaleanchor=False,
         dtick=100,
         minor=dict(ticklen=4, dtick=20),
         showgrid=True,
@@ -140,17 +240,17 @@ def generate_ionogram(ion):
         gridcolor='LightGrey'
     )
 
-    return fig.to_html(full_html=False)
+    return fig.to_html(full_html=False, include_plotlyjs='cdn', **PLOTLY_HTML_OPTIONS)
 
 def generate_noise_plot(ion):
-    if not ion.noise:
+    if ion.noise_amp.size == 0:
         return None
 
-    noise_data = np.array(ion.noise)
     frequencies = ion.get_frequences()[:-1]
     mask = frequencies <= 10
-    frequencies = frequencies[mask]
-    noise_levels = noise_data[mask, 1]
+    # Списки Python сериализуются в JSON без numpy-кодировщика Plotly
+    frequencies = frequencies[mask].tolist()
+    noise_levels = ion.noise_amp[mask].tolist()
 
     fig = go.Figure()
     fig.add_trace(
@@ -178,10 +278,10 @@ def generate_noise_plot(ion):
     )
 
     fig.update_xaxes(
-        range=[np.nanmin(frequencies), 10],
+        range=[frequencies[0], 10],
         dtick=1,
         showgrid=True,
         gridcolor='LightGrey'
     )
 
-    return fig.to_html(full_html=False)
+    return fig.to_html(full_html=False, include_plotlyjs=False, **PLOTLY_HTML_OPTIONS)
@@ -7,9 +7,7 @@
 # Этот файл содержит код, для выполнения логики накопления 
 # пакета ионограмм в многопоточном режиме.
 
-import re
 import os
-import copy
 import argparse
 import threading
 from typing import Optional
@@ -22,80 +20,109 @@ from ion_class import Ionogram
 def get_prefix():
   return "[{:s}\t{:06d}] >>".format(datetime.now().strftime('%d.%m.%Y %H:%M:%S'), threading.get_ident())
 
+def list_dat_files(dpath) -> set[str]:
+  """
+  Возвращает множество имён .dat-файлов в каталоге (один scandir вместо stat на каждый файл)
+  """
+  try:
+    with os.scandir(dpath) as it:
+      return {e.name for e in it if e.name.endswith('.dat')}
+  except OSError:
+    return set()
+
 def process(year, month, day, h, ms, me):
   global s_start
   global folder_in
   global folder_out
+  global existing_files
 
   dpath = folder_out(year, month, day)
   ofname = os.path.join(dpath, "{:02d}_{:02d}_{:02d}_{:02d}_{:02d}.dat".format(month, day, h, ms, s_start))
   if os.path.exists(ofname):
-    with progress_value.get_lock():
-      progress_value.value += 1
-      # print(get_prefix(), "File \"{:s}\" exists. Skip! Progress: {:.2f}% ({:d}/{:d})".format("{:02d}_{:02d}_{:02d}_{:02d}_{:02d}.dat".format(month, day, h, ms, s_start), float(progress_value.value / progress_total.value) * 100.0, progress_value.value, progress_total.value))
+    progress_value.value += 1
+    # print(get_prefix(), "File \"{:s}\" exists. Skip! Progress: {:.2f}% ({:d}/{:d})".format("{:02d}_{:02d}_{:02d}_{:02d}_{:02d}.dat".format(month, day, h, ms, s_start), float(progress_value.value / progress_total.value) * 100.0, progress_value.value, progress_total.value))
     return
 
-  nion = 0
-  ions = []
   print(get_prefix(), "Start process from {:02d}.{:02d} {:02d}:{:02d} - {:02d}:{:02d}. Progress: {:.2f}% ({:d}/{:d})".format(day, month, h, ms, h, min(59, me), float(progress_value.value / progress_total.value) * 100.0, progress_value.value, progress_total.value))
+  # Сначала отбираем существующие файлы окна по списку дня из main(): пустое окно пропускается без обращения к диску
+  dpath_in = folder_in(year, month, day)
+  existing = existing_files.get((year, month, day), set())
+  fnames = []
+  prefix = f"{month:02d}_{day:02d}_{h:02d}_"
   for m in range(ms, me):
     for s in range(s_start, 60, 15):
-      fname = os.path.join(folder_in(year, month, day), "{:02d}_{:02d}_{:02d}_{:02d}_{:02d}.dat".format(month, day, h, m, s))
-      if not os.path.exists(fname):
+      ifname = f"{prefix}{m:02d}_{s:02d}.dat"
+      fname = os.path.join(dpath_in, ifname)
+      if ifname not in existing:
         print(get_prefix(), "File {:s} doesn't exists!".format(fname))
         continue
-      # print('Reading file: ', fname)        
-      
-      ions.append(Ionogram())
-      ions[nion].readion(fname)
-      nion += 1
+      fnames.append(fname)
 
-  with progress_value.get_lock():
+  if not fnames:
     progress_value.value += 1
-
-  if len(ions) <= 0:
     print(get_prefix(), "Empty ionograms... Skip!")
     return
-  else:
-    print(get_prefix(), "Saving... Please, wait...")
 
-  # Суммируем ионограммы
-  sum_ion = copy.deepcopy(ions[0])
-  for ni,ii in enumerate(ions):
-    if(ni > 0):
-        sum_ion += ii
+  # Ионограммы суммируются по мере чтения, накопителем служит первая из них
+  sum_ion = None
+  for fname in fnames:
+    # print('Reading file: ', fname)
+    ion = Ionogram()
+    ion.readion(fname)
+    if sum_ion is None:
+      sum_ion = ion
+    else:
+      sum_ion += ion
+
+  progress_value.value += 1
+
+  print(get_prefix(), "Saving... Please, wait...")
 
   # Делим на количество, чтобы найти усредненную амплитуду
-  aion = sum_ion / len(ions)
+  sum_ion /= len(fnames)
   if not os.path.exists(dpath):
     os.makedirs(dpath)
-  aion.writeion(ofname)
+  sum_ion.writeion(ofname)
   print(get_prefix(), "Saved to: {:s}. Progress: {:.2f}% ({:d}/{:d})".format(ofname, float(progress_value.value / progress_total.value) * 100.0, progress_value.value, progress_total.value))
 
-def init_globals(pv, pt):
+def process_star(args):
+  return process(*args)
+
+def init_globals(pv, pt, ef=None):
   global progress_value
   global progress_total
+  global existing_files
 
   progress_value = pv
   progress_total = pt
+  # Имена .dat-файлов по дням {(год, месяц, день): множество}, собираются один раз в main()
+  existing_files = ef if ef is not None else {}
+
+  # Шаблоны путей читаются из окружения один раз
+  folder_in_tmpl = str(os.environ.get('FOLDER_IN'))
+  folder_out_tmpl = str(os.environ.get('FOLDER_OUT'))
 
   global folder_in
-  folder_in = lambda y, m, d: str(os.environ.get('FOLDER_IN')).format(
-    YEAR = str(y).zfill(2),
-    MONTH =  str(m).zfill(2),
-    DAY = str(d).zfill(2),
+  folder_in = lambda y, m, d: folder_in_tmpl.format(
+    YEAR = f"{y:02d}",
+    MONTH = f"{m:02d}",
+    DAY = f"{d:02d}",
   )
 
   global folder_out
-  folder_out = lambda y, m, d: str(os.environ.get('FOLDER_OUT')).format(
-    YEAR = str(y).zfill(2),
-    MONTH =  str(m).zfill(2),
-    DAY = str(d).zfill(2),
+  folder_out = lambda y, m, d: folder_out_tmpl.format(
+    YEAR = f"{y:02d}",
+    MONTH = f"{m:02d}",
+    DAY = f"{d:02d}",
   )
 
   global dm
   dm = int(os.environ.get('DELTA_MINUTES'))
 
+  # Проверка разрешения читает только каждую N-ю ионограмму внутри минуты (по умолчанию все)
+  global sample_stride
+  sample_stride = max(1, int(os.environ.get('SAMPLE_STRIDE') or 1))
+
   global date_from
   date_from = list(map(lambda x: int(x), str(os.environ.get('DATE_FROM')).split('-')))
 
@@ -114,18 +141,22 @@ def check_resolution() -> list[int, list[str]]:
   global date_to
   global date_from
   global folder_in
+  global sample_stride
 
   result = [None, []] # Разрешение первого, Список файлов с иным разрешением
   for year in range(date_from[0], date_to[0] + 1):
     for month in range(date_from[1], date_to[1] + 1):
       for day in range(date_from[2], date_to[2] + 1):
+        dpath_in = folder_in(year, month, day)
+        existing = list_dat_files(dpath_in)
         for h in range(0, 24):
+          prefix = f"{month:02d}_{day:02d}_{h:02d}_"
           for m in range(0, 60, dm):
-            for s in range(s_start, 60, 15):
-              ifname = "{:02d}_{:02d}_{:02d}_{:02d}_{:02d}.dat".format(month, day, h, m, s)
-              ifpath = os.path.join(folder_in(year, month, day), ifname)
-              if not os.path.exists(ifpath):
+            for s in range(s_start, 60, 15 * sample_stride):
+              ifname = f"{prefix}{m:02d}_{s:02d}.dat"
+              if ifname not in existing:
                 continue
+              ifpath = os.path.join(dpath_in, ifname)
 
               ionogram = Ionogram()
               ionogram.readion(ifpath)
@@ -162,9 +193,11 @@ def get_s_start() -> int:
   """
   fname = os.listdir(folder_in(date_from[0], date_from[1], date_from[2]))[0]
 
-  m = re.match("^\d{2}_\d{2}_\d{2}_\d{2}_(\d{2})\.dat$", fname)
-  if m:
-    return int(m.group(1))
+  # Имя вида MM_DD_hh_mm_ss.dat
+  stem, ext = os.path.splitext(fname)
+  parts = stem.split('_')
+  if ext == '.dat' and len(parts) == 5 and all(len(p) == 2 and p.isdigit() for p in parts):
+    return int(parts[4])
 
   return 0
 
@@ -175,14 +208,18 @@ def main(check: Optional[bool] = None):
   if not check_envs():
     return
 
-  progress_value = Value('i', 0)
-  progress_total = Value('i', 1)
+  # Счётчики без межпроцессной блокировки: прогресс приблизительный, зато процессы не ждут друг друга
+  progress_value = Value('i', 0, lock=False)
+  progress_total = Value('i', 1, lock=False)
 
   init_globals(0, 0)
   args = []
+  existing_files = {}
   for year in range(date_from[0], date_to[0] + 1):
     for month in range(date_from[1], date_to[1] + 1):
       for day in range(date_from[2], date_to[2] + 1):
+        # Каталог дня читается один раз, а не в каждой задаче
+        existing_files[(year, month, day)] = list_dat_files(folder_in(year, month, day))
         for h in range(0, 24):
           for m in range(0, 60, dm):
               args.append((year, month, day, h, m, m + dm))
@@ -202,8 +239,11 @@ def main(check: Optional[bool] = None):
   progress_total.value = len(args)
 
   print("Запуск программы в", cpu_count(), "потоков")
-  with Pool(initializer=init_globals, initargs=(progress_value, progress_total,)) as pool:
-    pool.starmap(process, args)
+  with Pool(initializer=init_globals, initargs=(progress_value, progress_total, existing_files,)) as pool:
+    # Задачи раздаются порциями по мере освобождения процессов
+    chunksize = max(1, len(args) // (cpu_count() * 4))
+    for _ in pool.imap_unordered(process_star, args, chunksize=chunksize):
+      pass
     print(get_prefix(), "Завершено", progress_value.value, ' / ', progress_total.value)
 
 